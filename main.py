@@ -6,27 +6,36 @@
 # her N mutasyonda snapshot dosyaya yazma (batch persist) içerir.
 
 import os
-import json
+import sys
+import asyncio
+import itertools
+import mmap
+import gzip
+import zlib
+import queue
+import threading
+import orjson
+import httpx
 import time
-import tempfile
-import shutil
-from typing import Set, Optional, Any, Dict, List
-from datetime import datetime
-from atomicwrites import atomic_write
+from typing import Set, Optional, Any, Dict, List, Deque, Iterable, Iterator
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import storage
 
-from collections import OrderedDict
-from threading import Lock
-from fastapi import FastAPI, Query, HTTPException, Body
-from pydantic import BaseModel
-from google.cloud import storage  # NEW
+from collections import deque
+from lru import LRU
+from sortedcontainers import SortedList
+from fastapi import FastAPI, Query, HTTPException, Body, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+from typing_extensions import TypedDict, NotRequired
 from dotenv import load_dotenv
 load_dotenv()
 
 BUCKET_NAME = os.getenv("BUCKET_NAME", "").strip()
 SNAPSHOT_BLOB = os.getenv("SNAPSHOT_BLOB", "").strip()
-PERSIST_FILE = os.getenv("PERSIST_FILE", "").strip()
-PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "2"))
+# PERSIST_* ayarları 4. bölümde (op-log + snapshot) tanımlı
 
 
 
@@ -35,10 +44,46 @@ PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "2"))
 
 
 app_title = "Remote Data Service (Memory, Multi-Store)"
-app = FastAPI(title=app_title)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Açılışta snapshot + op-log yükle, yazıcıları başlat; kapanışta durdur ve son snapshot'ı al."""
+    _load_snapshot_if_exists()
+    await _start_persist_writer()
+    yield
+    try:
+        await _stop_persist_writer()
+        _flush_on_shutdown()
+    finally:
+        await _close_http_client()
+
+# Tüm endpoint'ler dict döndürür; JSON encode işini orjson yapsın (stdlib json'dan hızlı)
+app = FastAPI(title=app_title, default_response_class=ORJSONResponse, lifespan=lifespan)
+# Sabit yanıt gövdeleri modül yüklenirken bir kez encode edilir
+_HOME_BODY = orjson.dumps({"message": "Remote Data Service is running successfully 🚀"})
+_EMPTY_QUERY_BODY = orjson.dumps({"ok": False, "error": "empty query"})
+
 @app.get("/")
-def home():
-    return {"message": "Remote Data Service is running successfully 🚀"}
+async def home():
+    return Response(content=_HOME_BODY, media_type="application/json")
+
+def _orjson_default(obj: Any):
+    """orjson'un tanımadığı tipler için (ör. set, deque) dönüştürücü."""
+    if isinstance(obj, (set, frozenset, deque)):
+        return list(obj)
+    raise TypeError
+
+def _dumps(payload: Any) -> bytes:
+    return orjson.dumps(payload, default=_orjson_default,
+                        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC)
+
+def _json_response(payload: Any) -> Response:
+    """Payload'ı doğrudan orjson ile byte'a çevirip döndürür (jsonable_encoder atlanır).
+
+    Not: default_response_class=ORJSONResponse olsa da FastAPI dönen dict'i önce
+    jsonable_encoder'dan geçirir; sıcak endpoint'ler bu yüzden Response döndürür.
+    """
+    return Response(content=_dumps(payload), media_type="application/json")
 
 # =================================================
 # 1) CORE: MULTI-STORE (Memory Only)
@@ -46,19 +91,52 @@ def home():
 
 # Birden fazla store tutulur: STORES["store_adi"]["key"] = value
 STORES: Dict[str, Dict[str, Any]] = {}
+# Her store için sıralı key indeksi: /keys her istekte sort yapmak yerine buradan okur
+STORE_INDEX: Dict[str, SortedList] = {}
 
-class KV(BaseModel):
+class KV(TypedDict):
     key: str
     value: Any  # string, int, dict vb.
 
-def ensure_store(name: str) -> Dict[str, Any]:
-    """Store yoksa oluştur, varsa döndür."""
+# BaseModel yerine TypedDict + TypeAdapter: body'yi tek adımda (validate_json) doğrular
+_KV_ADAPTER = TypeAdapter(KV)
+
+def _parse_body(adapter: TypeAdapter, body: bytes):
+    """Ham body'yi doğrular; hata olursa FastAPI'nin 422 formatında döner."""
+    try:
+        return adapter.validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors()])
+
+def _body_schema(adapter: TypeAdapter) -> dict:
+    """Swagger'da request body şeması görünsün diye openapi_extra üretir."""
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": adapter.json_schema()}}}}
+
+# Bellek sınırları (env ile ayarlanır). Aşılırsa 507 Insufficient Storage döner.
+# list/set isimleri de store sayısı gibi MAX_STORES ile, elemanları MAX_KEYS_PER_STORE ile sınırlanır.
+MAX_STORES = int(os.getenv("MAX_STORES", "1000"))
+MAX_KEYS_PER_STORE = int(os.getenv("MAX_KEYS_PER_STORE", "100000"))
+
+def _check_capacity(current: int, limit: int, what: str):
+    if current >= limit:
+        raise HTTPException(507, f"{what} limit reached ({limit})")
+
+def ensure_store(name: str, enforce_limit: bool = True) -> Dict[str, Any]:
+    """Store yoksa oluştur, varsa döndür. (Replay sırasında limit uygulanmaz.)"""
     if name not in STORES:
+        if enforce_limit:
+            _check_capacity(len(STORES), MAX_STORES, "Store")
         STORES[name] = {}
+        STORE_INDEX[name] = SortedList()
     return STORES[name]
+
+def _rebuild_index():
+    """Snapshot yüklendikten sonra key indekslerini baştan kurar."""
+    STORE_INDEX.clear()
+    STORE_INDEX.update({name: SortedList(s) for name, s in STORES.items()})
 #-----GEÇİCİ EKLENDİ-------------
 @app.get("/debug-env")
-def debug_env():
+async def debug_env():
     return {
         "BUCKET_NAME": BUCKET_NAME,
         "SNAPSHOT_BLOB": SNAPSHOT_BLOB,
@@ -69,51 +147,72 @@ def debug_env():
 #-------------------------------
 # --- Health ---
 @app.get("/health")
-def health():
-    return {"status": "up", "backend": "memory", "stores": list(STORES.keys())}
+async def health():
+    return _json_response({
+        "status": "up",
+        "backend": "memory",
+        "stores": list(STORES.keys()),
+        "sizes": {
+            "stores": len(STORES),
+            "keys": sum(len(s) for s in STORES.values()),
+            "lists": len(lists),
+            "sets": len(sets_),
+        },
+        "limits": {"max_stores": MAX_STORES, "max_keys_per_store": MAX_KEYS_PER_STORE},
+    })
 
 # --- Store yönetimi ---
 @app.get("/stores")
-def list_stores() -> List[str]:
-    return sorted(STORES.keys())
+async def list_stores():
+    return _json_response(sorted(STORES.keys()))
 
 @app.put("/stores/{store}")
-def create_store(store: str):
-    ensure_store(store)
+async def create_store(store: str):
+    if store not in STORES:
+        ensure_store(store)
+        _bump_mutation(); _append_op({"op": "create_store", "store": store}); _maybe_persist()
     return {"ok": True, "store": store}
 
 @app.delete("/stores/{store}")
-def delete_store(store: str):
+async def delete_store(store: str):
     if store in STORES:
         del STORES[store]
+        STORE_INDEX.pop(store, None)
+        _bump_mutation(); _append_op({"op": "drop_store", "store": store}); _maybe_persist()
         return {"ok": True, "deleted": store}
     raise HTTPException(404, f"Store '{store}' not found")
 
 # --- SET/GET/DEL (Redis SET/GET benzeri) ---
-@app.post("/stores/{store}/set")
-def set_item(store: str, item: KV):
+@app.post("/stores/{store}/set", openapi_extra=_body_schema(_KV_ADAPTER))
+async def set_item(store: str, request: Request):
+    item = _parse_body(_KV_ADAPTER, await request.body())
+    key, value = item["key"], item["value"]
     s = ensure_store(store)
-    s[item.key] = item.value
-    _bump_mutation(); _maybe_persist()
-    return {"ok": True, "store": store, "key": item.key, "value": item.value}
+    if key not in s:
+        _check_capacity(len(s), MAX_KEYS_PER_STORE, f"Store '{store}' key")
+        STORE_INDEX[store].add(key)
+    s[key] = value
+    _bump_mutation(); _append_op({"op": "set", "store": store, "key": key, "value": value}); _maybe_persist()
+    return _json_response({"ok": True, "store": store, "key": key, "value": value})
 
 @app.get("/stores/{store}/get/{key}")
-def get_item(store: str, key: str):
-    s = STORES.get(store)
-    if not s or key not in s:
+async def get_item(store: str, key: str):
+    try:  # EAFP: hit yolunda tek zincir lookup
+        return _json_response({"ok": True, "store": store, "key": key, "value": STORES[store][key]})
+    except KeyError:
         raise HTTPException(404, f"Key '{key}' not found in store '{store}'")
-    return {"ok": True, "store": store, "key": key, "value": s[key]}
 
 @app.delete("/stores/{store}/del/{key}")
-def del_item(store: str, key: str):
-    s = STORES.get(store)
-    if not s or key not in s:
-        return {"ok": False, "deleted": False, "store": store, "key": key}
-    del s[key]
-    _bump_mutation(); _maybe_persist()
-    return {"ok": True, "deleted": True, "store": store, "key": key}
+async def del_item(store: str, key: str):
+    try:
+        del STORES[store][key]
+    except KeyError:
+        return _json_response({"ok": False, "deleted": False, "store": store, "key": key})
+    STORE_INDEX[store].remove(key)
+    _bump_mutation(); _append_op({"op": "del", "store": store, "key": key}); _maybe_persist()
+    return _json_response({"ok": True, "deleted": True, "store": store, "key": key})
 @app.put("/stores/{store}/update/{key}")
-def update_item(store: str, key: str, value: Any = Body(...)):
+async def update_item(store: str, key: str, value: Any = Body(...)):
     """
     Var olan bir store içindeki key'in değerini günceller.
     Eğer store veya key yoksa hata döner.
@@ -126,80 +225,120 @@ def update_item(store: str, key: str, value: Any = Body(...)):
 
     s[key] = value
     _bump_mutation()
+    _append_op({"op": "set", "store": store, "key": key, "value": value})
     _maybe_persist()
-    return {"ok": True, "store": store, "key": key, "new_value": value}
+    return _json_response({"ok": True, "store": store, "key": key, "new_value": value})
 
 # --- Store içi listeleme / prefix ---
 @app.get("/stores/{store}/keys")
-def list_keys(store: str, prefix: Optional[str] = Query(None, description="İstersen prefix filtrele")):
+async def list_keys(store: str, prefix: Optional[str] = Query(None, description="İstersen prefix filtrele")):
     s = STORES.get(store)
     if not s:
         raise HTTPException(404, f"Store '{store}' not found")
-    keys = list(s.keys())
+    idx = STORE_INDEX[store]
     if prefix:
-        keys = [k for k in keys if k.startswith(prefix)]
-    keys.sort()
-    return {"store": store, "count": len(keys), "keys": keys}
+        # indeks sıralı: prefix'ten başla, eşleşme bitince dur (O(log n + eşleşme))
+        keys = list(itertools.takewhile(lambda k: k.startswith(prefix), idx.irange(minimum=prefix)))
+    else:
+        keys = list(idx)
+    return _json_response({"store": store, "count": len(keys), "keys": keys})
 
 @app.get("/stores/{store}/items")
-def list_items(store: str):
+async def list_items(store: str):
     s = STORES.get(store)
     if not s:
         raise HTTPException(404, f"Store '{store}' not found")
-    return {"store": store, "size": len(s), "items": [{"key": k, "value": v} for k, v in s.items()]}
+    # sığ kopya: stream sürerken gelen mutasyonlar iterasyonu bozmasın (C seviyesinde hızlı)
+    return StreamingResponse(_iter_items(store, dict(s)), media_type="application/json")
+
+ITEMS_STREAM_BATCH = 1000
+
+async def _iter_items(store: str, s: Dict[str, Any]):
+    """items yanıtını parça parça üretir; bellekte en fazla bir batch'lik dict listesi olur."""
+    yield b'{"store":' + _dumps(store) + b',"size":' + str(len(s)).encode() + b',"items":['
+    it = iter(s.items())
+    sep = b""
+    while True:
+        chunk = [{"key": k, "value": v} for k, v in itertools.islice(it, ITEMS_STREAM_BATCH)]
+        if not chunk:
+            break
+        yield sep + _dumps(chunk)[1:-1]  # dış [ ] atılır, parçalar virgülle birleşir
+        sep = b","
+    yield b"]}"
 
 # =================================================
 # 2) LIST / SET KOMUTLARI (Opsiyonel)
 # =================================================
-lists: Dict[str, List[str]] = {}
+lists: Dict[str, Deque[str]] = {}  # deque: LPUSH/LPOP baştan O(1)
 sets_: Dict[str, Set[str]] = {}
 
-class Command(BaseModel):
+class Command(TypedDict):
     command: str
     stack_name: str
-    value: Optional[str] = None
-
-@app.post("/command")
-def run_command(cmd: Command):
-    c = cmd.command.upper()
-
-    if c == "LPUSH":
-        if cmd.value is None:
-            raise HTTPException(400, detail="LPUSH requires 'value'")
-        lst = lists.setdefault(cmd.stack_name, [])
-        lst.insert(0, cmd.value)
-        _bump_mutation(); _maybe_persist()
-        return {"ok": True, "type": "list", "name": cmd.stack_name, "length": len(lst)}
-
-    elif c == "LPOP":
-        lst = lists.get(cmd.stack_name, [])
-        if not lst:
-            _bump_mutation(); _maybe_persist()
-            return {"ok": True, "type": "list", "name": cmd.stack_name, "value": None}
-        val = lst.pop(0)
-        _bump_mutation(); _maybe_persist()
-        return {"ok": True, "type": "list", "name": cmd.stack_name, "value": val, "length": len(lst)}
-
-    elif c in ("SADD", "SPUSH"):
-        if cmd.value is None:
-            raise HTTPException(400, detail="SADD requires 'value'")
-        s = sets_.setdefault(cmd.stack_name, set())
-        before = len(s)
-        s.add(cmd.value)
+    value: NotRequired[Optional[str]]
+
+_COMMAND_ADAPTER = TypeAdapter(Command)
+
+def _do_lpush(name: str, value: Optional[str]):
+    if value is None:
+        raise HTTPException(400, detail="LPUSH requires 'value'")
+    lst = lists.get(name)
+    if lst is None:
+        _check_capacity(len(lists), MAX_STORES, "List")
+        lst = lists[name] = deque()
+    _check_capacity(len(lst), MAX_KEYS_PER_STORE, f"List '{name}' item")
+    lst.appendleft(value)
+    _bump_mutation(); _append_op({"op": "lpush", "name": name, "value": value}); _maybe_persist()
+    return {"ok": True, "type": "list", "name": name, "length": len(lst)}
+
+def _do_lpop(name: str, value: Optional[str]):
+    lst = lists.get(name)
+    if not lst:
         _bump_mutation(); _maybe_persist()
-        return {"ok": True, "type": "set", "name": cmd.stack_name, "added": int(len(s) > before), "size": len(s)}
-
-    elif c == "SPOP":
-        s = sets_.get(cmd.stack_name, set())
-        if not s:
-            _bump_mutation(); _maybe_persist()
-            return {"ok": True, "type": "set", "name": cmd.stack_name, "value": None}
-        val = s.pop()
+        return {"ok": True, "type": "list", "name": name, "value": None}
+    val = lst.popleft()
+    _bump_mutation(); _append_op({"op": "lpop", "name": name}); _maybe_persist()
+    return {"ok": True, "type": "list", "name": name, "value": val, "length": len(lst)}
+
+def _do_sadd(name: str, value: Optional[str]):
+    if value is None:
+        raise HTTPException(400, detail="SADD requires 'value'")
+    s = sets_.get(name)
+    if s is None:
+        _check_capacity(len(sets_), MAX_STORES, "Set")
+        s = sets_[name] = set()
+    if value not in s:
+        _check_capacity(len(s), MAX_KEYS_PER_STORE, f"Set '{name}' item")
+    before = len(s)
+    s.add(value)
+    _bump_mutation(); _append_op({"op": "sadd", "name": name, "value": value}); _maybe_persist()
+    return {"ok": True, "type": "set", "name": name, "added": int(len(s) > before), "size": len(s)}
+
+def _do_spop(name: str, value: Optional[str]):
+    s = sets_.get(name)
+    if not s:
         _bump_mutation(); _maybe_persist()
-        return {"ok": True, "type": "set", "name": cmd.stack_name, "value": val, "size": len(s)}
+        return {"ok": True, "type": "set", "name": name, "value": None}
+    val = s.pop()
+    _bump_mutation(); _append_op({"op": "srem", "name": name, "value": val}); _maybe_persist()
+    return {"ok": True, "type": "set", "name": name, "value": val, "size": len(s)}
+
+# Komut -> handler: tek hash lookup ile dispatch; yeni komut eklemek için buraya bir satır yeter
+_CMD_HANDLERS = {
+    "LPUSH": _do_lpush,
+    "LPOP": _do_lpop,
+    "SADD": _do_sadd,
+    "SPUSH": _do_sadd,
+    "SPOP": _do_spop,
+}
 
-    else:
-        raise HTTPException(400, detail=f"Unknown command: {cmd.command}")
+@app.post("/command", openapi_extra=_body_schema(_COMMAND_ADAPTER))
+async def run_command(request: Request):
+    cmd = _parse_body(_COMMAND_ADAPTER, await request.body())
+    handler = _CMD_HANDLERS.get(cmd["command"].upper())
+    if handler is None:
+        raise HTTPException(400, detail=f"Unknown command: {cmd['command']}")
+    return _json_response(handler(cmd["stack_name"], cmd.get("value")))
 
 # =================================================
 # 3) LRU + TTL CACHE (/search)
@@ -207,34 +346,65 @@ def run_command(cmd: Command):
 CACHE_TTL_SECONDS = 300
 CACHE_MAX_ITEMS   = 100
 
-_cache_lock = Lock()
-_cache: "OrderedDict[str, dict[str, Any]]" = OrderedDict()
-# her entry: key -> {"value": Any, "ts": float(epoch)}
+# Kilit yok: handler'lar event loop'ta çalışır, LRU'nun C metodları GIL altında atomik
+_cache = LRU(CACHE_MAX_ITEMS)
+# her entry: key -> (orjson ile encode edilmiş data bytes, ts(monotonic)); erişim MRU'ya taşır,
+# taşma en eskiyi otomatik atar. Hit'te data tekrar serileştirilmez.
 
 def _cache_get(key: str):
     """Cache'den oku (varsa & süresi dolmadıysa)."""
-    now = time.time()
-    with _cache_lock:
-        item = _cache.get(key)
-        if not item:
-            return None
-        if now - item["ts"] > CACHE_TTL_SECONDS:
-            _cache.pop(key, None)
-            return None
-        _cache.move_to_end(key, last=True)
-        return item["value"]
-
-def _cache_put(key: str, value: Any):
-    """Cache'e yaz (gerekirse en eskiyi sil)."""
-    now = time.time()
-    with _cache_lock:
-        _cache[key] = {"value": value, "ts": now}
-        _cache.move_to_end(key, last=True)
-        while len(_cache) > CACHE_MAX_ITEMS:
-            _cache.popitem(last=False)
-
-def call_external_api(query: str) -> Any:
-    """Demo dış servis."""
+    now = time.monotonic()  # saat ayarından etkilenmez, time.time()'dan ucuz
+    item = _cache.get(key)
+    if not item:
+        return None
+    value, ts = item
+    if now - ts > CACHE_TTL_SECONDS:
+        _cache.pop(key, None)
+        return None
+    return value
+
+def _cache_put(key: str, value: bytes):
+    """Cache'e yaz (doluysa en eskisi LRU tarafından silinir)."""
+    _cache[key] = (value, time.monotonic())
+
+# Ham sorgu -> normalize edilmiş cache key (tekrarlayan sorgularda strip/casefold yapılmaz)
+NORMALIZE_CACHE_MAX = 4096
+_normalize_cache: Dict[str, str] = {}
+
+def _normalize_query(q: str) -> str:
+    key = _normalize_cache.get(q)
+    if key is None:
+        key = q.strip().casefold()
+        if len(_normalize_cache) < NORMALIZE_CACHE_MAX:
+            key = sys.intern(key)  # aynı key tek nesne: LRU lookup'ında eşitlik kimlik kontrolüyle biter
+            _normalize_cache[q] = key
+    return key
+
+# Gerçek dış servis (opsiyonel). Boşsa demo veri döner.
+EXTERNAL_API_URL = os.getenv("EXTERNAL_API_URL", "").strip()
+
+# Tek AsyncClient: cache miss'lerde TCP/TLS bağlantıları sıcak kalır, event loop bloklanmaz
+_http: Optional[httpx.AsyncClient] = None
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            timeout=10,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return _http
+
+async def call_external_api(query: str) -> Any:
+    """Dış servis (EXTERNAL_API_URL varsa async HTTP, yoksa demo)."""
+    if EXTERNAL_API_URL:
+        try:
+            r = await _get_http_client().get(EXTERNAL_API_URL, params={"q": query})
+            r.raise_for_status()
+            return orjson.loads(r.content)
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+            print(f"[ERROR] External API call failed: {e}")
+            raise HTTPException(502, "External API request failed")
     sample = [
         {"id": 1, "title": f"{query} ürünü A"},
         {"id": 2, "title": f"{query} ürünü B"},
@@ -243,35 +413,87 @@ def call_external_api(query: str) -> Any:
     return {"res": sample}
 
 
+async def _close_http_client():
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+
 @app.get("/search")
-def search(q: str = Query(..., description="Arama sorgusu")):
-    key = q.strip().lower()
+async def search(q: str = Query(..., description="Arama sorgusu")):
+    key = _normalize_query(q)
     if not key:
-        return {"ok": False, "error": "empty query"}
+        return Response(content=_EMPTY_QUERY_BODY, media_type="application/json")
 
     cached = _cache_get(key)
     if cached is not None:
-        return {"ok": True, "source": "cache", "query": q, "data": cached}
+        return _search_response(b"cache", q, cached)
 
-    data = call_external_api(key)
+    data = orjson.dumps(await call_external_api(key))
     _cache_put(key, data)
-    return {"ok": True, "source": "api", "query": q, "data": data}
+    return _search_response(b"api", q, data)
+
+def _search_response(source: bytes, q: str, data: bytes) -> Response:
+    """Hazır data bytes'ını zarfın içine ekler; sadece query string encode edilir."""
+    body = b'{"ok":true,"source":"' + source + b'","query":' + orjson.dumps(q) + b',"data":' + data + b"}"
+    return Response(content=body, media_type="application/json")
 
 # =================================================
-# 4) BATCH SNAPSHOT (her N mutasyonda /tmp'ye yaz)
+# 4) OP-LOG + SNAPSHOT (her mutasyon JSONL'e, periyodik compaction)
 # =================================================
 
 # Cloud Run için /tmp güvenli; lokalde istersek env ile değiştirilebilir.
 PERSIST_FILE = os.getenv("PERSIST_FILE", "/tmp/rds_snapshot.json")
-PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "2"))
-
-_persist_lock = Lock()
-_ops_since_last_persist = 0  # kaç mutasyon oldu sayacı
+PERSIST_LOG_FILE = os.getenv("PERSIST_LOG_FILE", PERSIST_FILE + ".log")
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "100"))
+PERSIST_DEBOUNCE_SECONDS = float(os.getenv("PERSIST_DEBOUNCE_SECONDS", "0.1"))
+# Op-log grup commit penceresi: ilk op'tan sonra bu kadar bekleyip gelenleri tek writev+fsync'te yazar
+PERSIST_FLUSH_INTERVAL = float(os.getenv("PERSIST_FLUSH_INTERVAL_MS", "100")) / 1000
+PERSIST_COMPACT_BATCHES = int(os.getenv("PERSIST_COMPACT_BATCHES", "100"))      # K log batch'inde bir snapshot
+PERSIST_LOG_MAX_BYTES = int(os.getenv("PERSIST_LOG_MAX_BYTES", str(8 * 1024 * 1024)))
+# Zaman bazlı compaction: log'da yeni op varsa en geç bu kadar saniyede bir snapshot (0 = kapalı)
+PERSIST_COMPACT_INTERVAL = float(os.getenv("PERSIST_COMPACT_INTERVAL_SECONDS", "300"))
+# 0 ise log batch'leri fsync'lenmez (Redis AOF "everysec/no" benzeri); snapshot her zaman fsync'lenir
+PERSIST_LOG_FSYNC = os.getenv("PERSIST_LOG_FSYNC", "1") != "0"
+OPLOG_QUEUE_SIZE = 10000
+OPLOG_MAX_BATCH = 512  # tek writev'e giren satır sayısı (IOV_MAX altında)
+OPLOG_PUT_TIMEOUT = 1.0  # compaction işareti (persist thread'i) kuyruk doluysa en fazla bu kadar bekler
+OPLOG_SHUTDOWN_TIMEOUT = 10.0  # kapanışta writer'ın kuyruğu bitirmesi için üst sınır
+# Başarısız snapshot'tan sonra yeniden denemeden önce beklenecek süre
+PERSIST_RETRY_BACKOFF = float(os.getenv("PERSIST_RETRY_BACKOFF_SECONDS", "30"))
+
+_persist_lock = threading.Lock()  # sadece snapshot yazımını sıralar, mutasyon yolunda kullanılmaz
+_mutation_counter = itertools.count(1)  # next() GIL altında atomik
+_mutations = 0      # toplam mutasyon sayısı (op-log'daki seq)
+_persisted_at = 0   # son snapshot'ın kapsadığı seq
+_persist_event: Optional[asyncio.Event] = None  # compaction isteği, writer task uyanır
+_persist_writer: Optional[asyncio.Task] = None  # tek arka plan yazıcı (startup'ta başlar)
+_persist_loop_ref: Optional[asyncio.AbstractEventLoop] = None
+
+# Op-log: (seq, satır) kuyruğu; satır None ise "seq'e kadar snapshot'ta, logu buda" işareti
+_oplog_queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=OPLOG_QUEUE_SIZE)
+_oplog_thread: Optional[threading.Thread] = None
+_oplog_bytes = 0  # log dosyasının güncel boyutu (status için)
+
+# Snapshot yazımı/GCS upload'u tek işçili özel executor'da: istek thread'lerini ve
+# default executor'ı bloklamaz, yazımlar sırayla yapılır.
+_persist_executor: Optional[ThreadPoolExecutor] = None
+_persist_pending = threading.Event()  # kuyrukta bekleyen snapshot var mı (fallback yolda birikmeyi önler)
 #----------------------------------------------------
-snapshot = {
-    "stores": STORES,  # veya başka dict
-    "timestamp": datetime.utcnow().isoformat()
-}
+
+# Büyük (resumable) upload'larda 256 KiB varsayılan yerine 8 MiB parça.
+# 8 MiB ve altı snapshot'ları kütüphane zaten tek istekte (multipart, resumable değil) yükler.
+GCS_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Tek storage.Client: kimlik bilgisi bir kez okunur, HTTP bağlantı havuzu sıcak kalır
+_gcs_client: Optional[storage.Client] = None
+
+def _get_gcs_client() -> storage.Client:
+    global _gcs_client
+    if _gcs_client is None:
+        _gcs_client = storage.Client()
+    return _gcs_client
 
 #değiştirildi
 def upload_to_gcs(snapshot_dict: dict, gcs_uri: str):
@@ -285,13 +507,14 @@ def upload_to_gcs(snapshot_dict: dict, gcs_uri: str):
 
     print(f"[DEBUG] bucket_name={bucket_name}, file_path={file_path}")
 
-    client = storage.Client()
+    client = _get_gcs_client()
     bucket = client.bucket(bucket_name)
-    blob = bucket.blob(file_path)
+    blob = bucket.blob(file_path, chunk_size=GCS_UPLOAD_CHUNK_SIZE)
 
     try:
         blob.upload_from_string(
-            json.dumps(snapshot_dict, indent=2),
+            orjson.dumps(snapshot_dict, default=_orjson_default,
+                         option=orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2),
             content_type="application/json"
         )
         print(f"[INFO] Snapshot uploaded to gs://{bucket_name}/{file_path}")
@@ -302,27 +525,55 @@ def upload_to_gcs(snapshot_dict: dict, gcs_uri: str):
 
 
 
+def _utc_timestamp() -> str:
+    """datetime nesnesi kurmadan UTC ISO-8601 zaman damgası (datetime.utcnow().isoformat() formatında)."""
+    ts = time.time()
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ts)) + f".{int(ts % 1 * 1e6):06d}"
+
 def _serialize_snapshot() -> dict:
-    """Bellekteki tüm verileri (stores, lists, sets) JSON formatına hazırlar."""
+    """Bellekteki tüm verilerin (stores, lists, sets) sığ kopyasını alır.
+
+    Event loop'ta çağrılır: kopya seq ile tutarlıdır ve sadece dict/list kopyası
+    olduğu için ucuzdur; asıl JSON encode'u persist executor'ında yapılır.
+    Değerler paylaşılır (yerinde değiştirilmez, hep yeniden atanır).
+    """
     return {
-        "stores": STORES,
-        "lists": lists,
-        "sets": {k: list(v) for k, v in sets_.items()},
-        "timestamp": datetime.utcnow().isoformat()
+        "stores": {name: dict(s) for name, s in STORES.items()},
+        "lists": {name: list(lst) for name, lst in lists.items()},
+        "sets": {name: list(s) for name, s in sets_.items()},
+        "seq": _mutations,  # bu seq'e kadarki op'lar snapshot'ta; replay bunları atlar
+        "timestamp": _utc_timestamp(),
     }
+
+def _dump_snapshot(snap: dict) -> Iterator[bytes]:
+    """Snapshot'ı store store encode edip parça parça üretir; birleşik çıktı tek satırlık JSON'dur.
+
+    Parçalar üretildikçe yazılır: bellekte aynı anda tek store'un çıktısı bulunur.
+    """
+    stores = snap["stores"]
+    head = {k: v for k, v in snap.items() if k != "stores"}
+    # _dumps ile aynı seçenekler: str olmayan key'ler string'e çevrilir
+    yield _dumps(head)[:-1] + b',"stores":{'  # kapanış "}" atılır
+    sep = b""
+    for name, store in stores.items():
+        yield sep + _dumps(name) + b":" + _dumps(store)
+        sep = b","
+    yield b"}}\n"
 #------------------ sonradan eklendi
 def _gcs_download():
     """GCS'den snapshot dosyasını indirir."""
     try:
         if not BUCKET_NAME or not SNAPSHOT_BLOB:
             return None
-        client = storage.Client()
+        client = _get_gcs_client()
         bucket = client.bucket(BUCKET_NAME)
-        blob = bucket.blob(SNAPSHOT_BLOB)
-        if not blob.exists():
+        blob = bucket.get_blob(SNAPSHOT_BLOB)  # metadata (content_encoding) ile birlikte
+        if blob is None:
             print(f"[INFO] No existing snapshot found in bucket {BUCKET_NAME}")
             return None
-        data = blob.download_as_bytes()
+        data = blob.download_as_bytes(raw_download=True)
+        if blob.content_encoding == "gzip":
+            data = gzip.decompress(data)
         print(f"[INFO] Snapshot downloaded from {BUCKET_NAME}/{SNAPSHOT_BLOB}")
         return data
     except Exception as e:
@@ -331,57 +582,339 @@ def _gcs_download():
 
 #-------
 
-def _persist_snapshot():
-    """Bellekteki tüm store'ları JSON olarak kaydeder ve GCS'ye yükler."""
+def _atomic_write(path: str, chunks: Iterable[bytes]):
+    """Parçaları geçici dosyaya yazıp fsync'ler, sonra os.replace ile atomik olarak yerine koyar."""
+    tmp = path + ".tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
     try:
-        data = json.dumps(STORES, indent=2).encode("utf-8")
-        # 1️⃣ Önce local /tmp klasörüne yaz
-        tmp_path = "/tmp/rds_snapshot.json"
-        with open(tmp_path, "wb") as f:
-            f.write(data)
-        print(f"[INFO] Snapshot written locally to {tmp_path}")
-
-        # 2️⃣ GCS'ye yükle
-        if BUCKET_NAME:
-            client = storage.Client()
-            bucket = client.bucket(BUCKET_NAME)
-            blob = bucket.blob(SNAPSHOT_BLOB)
-            blob.upload_from_filename(tmp_path)
-            print(f"[INFO] Snapshot uploaded to gs://{BUCKET_NAME}/{SNAPSHOT_BLOB}")
-
-    except Exception as e:
-        print(f"[ERROR] Failed to upload snapshot to GCS: {e}")
-        raise HTTPException(status_code=500, detail="Failed to upload snapshot to GCS.")
-
-    
-
+        for chunk in chunks:
+            view = memoryview(chunk)
+            while view:
+                view = view[os.write(fd, view):]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, path)
+
+GCS_GZIP_LEVEL = 4  # oran/CPU dengesi
+
+def _gzip_tee(chunks: Iterable[bytes], out: List[bytes]) -> Iterator[bytes]:
+    """Parçaları aynen geçirirken gzip'ler; sadece sıkıştırılmış çıktı out'ta birikir."""
+    co = zlib.compressobj(GCS_GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits=31: gzip başlığı
+    for c in chunks:
+        out.append(co.compress(c))
+        yield c
+    out.append(co.flush())
+
+def _persist_snapshot(snap: Optional[dict] = None):
+    """Bellekteki tüm store'ları JSON olarak kaydeder, GCS'ye yükler ve op-log'u budar."""
+    with _persist_lock:
+        try:
+            snap = snap or _serialize_snapshot()
+            seq = snap["seq"]
+            chunks = _dump_snapshot(snap)
+            gz: List[bytes] = []
+            if BUCKET_NAME:  # dosyaya yazılırken aynı parçalar sıkıştırılır
+                chunks = _gzip_tee(chunks, gz)
+            # 1️⃣ Önce local /tmp klasörüne yaz
+            tmp_path = PERSIST_FILE
+            _atomic_write(tmp_path, chunks)
+            print(f"[INFO] Snapshot written locally to {tmp_path}")
+
+            # 2️⃣ GCS'ye yükle
+            if BUCKET_NAME:
+                client = _get_gcs_client()
+                bucket = client.bucket(BUCKET_NAME)
+                blob = bucket.blob(SNAPSHOT_BLOB, chunk_size=GCS_UPLOAD_CHUNK_SIZE)
+                # JSON çok iyi sıkışır: upload süresi ve depolama maliyeti düşer
+                blob.content_encoding = "gzip"
+                blob.upload_from_string(b"".join(gz), content_type="application/json")
+                print(f"[INFO] Snapshot uploaded to gs://{BUCKET_NAME}/{SNAPSHOT_BLOB}")
+
+        except Exception as e:
+            print(f"[ERROR] Failed to upload snapshot to GCS: {e}")
+            raise HTTPException(status_code=500, detail="Failed to upload snapshot to GCS.")
+
+        # 3️⃣ Snapshot'a giren op'ları logdan düş (compaction)
+        if _oplog_thread is not None:
+            try:
+                _oplog_queue.put((seq, None), timeout=OPLOG_PUT_TIMEOUT)
+            except queue.Full:  # budama atlanır; replay snapshot'taki op'ları zaten atlar
+                print("[WARN] op-log queue full; compaction skipped")
+
+
+def _get_persist_executor() -> ThreadPoolExecutor:
+    global _persist_executor
+    if _persist_executor is None:
+        _persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persist")
+    return _persist_executor
+
+async def _run_persist():
+    """Loop'ta sığ kopya alır; encode, yazım ve upload persist executor'ında yapılır."""
+    snap = _serialize_snapshot()
+    await asyncio.get_running_loop().run_in_executor(_get_persist_executor(), _persist_snapshot, snap)
+
+def _submit_persist():
+    """Loop'suz (fallback) yol: snapshot'ı executor'a atar; zaten bekleyen varsa tekrar eklemez."""
+    if _persist_pending.is_set():
+        return
+    _persist_pending.set()
+
+    def job():
+        _persist_pending.clear()  # bundan sonraki mutasyonlar yeni bir iş tetikleyebilir
+        try:
+            _persist_snapshot()
+        except Exception as e:
+            print(f"[WARN] background persist failed: {e}")
 
+    _get_persist_executor().submit(job)
 
 @app.post("/snapshot")
-def create_snapshot():
-    _persist_snapshot()
+async def create_snapshot():
+    await _run_persist()
     return {"ok": True, "message": "Snapshot saved to GCS"}
 
 
-    # 2) Olmazsa /tmp'ye yaz (fallback)
-   
-
 def _bump_mutation():
-    global _ops_since_last_persist
-    with _persist_lock:
-        _ops_since_last_persist += 1
+    global _mutations
+    _mutations = next(_mutation_counter)
+
+def _append_op(op: dict):
+    """Mutasyonu tek JSONL satırı olarak op-log kuyruğuna ekler (yazımı writer thread yapar)."""
+    if _oplog_thread is None:
+        return
+    op["seq"] = _mutations
+    try:
+        _oplog_queue.put_nowait((_mutations, orjson.dumps(op) + b"\n"))  # event loop'ta: beklemez
+    except queue.Full:
+        # yazıcı yetişemiyor: op log'a girmez, bir sonraki snapshot onu kapsar
+        print("[WARN] op-log queue full; op not logged, snapshot requested")
+        if _persist_event is not None:
+            _persist_event.set()
+
+def _apply_op(op: dict):
+    """Op-log replay: tek bir kaydı belleğe uygular."""
+    kind = op["op"]
+    if kind == "set":
+        store, key = op["store"], op["key"]  # eksik alan store oluşturmadan KeyError verir
+        s = ensure_store(store, enforce_limit=False)
+        if key not in s:
+            STORE_INDEX[store].add(key)
+        s[key] = op.get("value")
+    elif kind == "del":
+        s = STORES.get(op["store"], {})
+        if op["key"] in s:
+            del s[op["key"]]
+            STORE_INDEX[op["store"]].remove(op["key"])
+    elif kind == "create_store":
+        ensure_store(op["store"], enforce_limit=False)
+    elif kind == "drop_store":
+        STORES.pop(op["store"], None)
+        STORE_INDEX.pop(op["store"], None)
+    elif kind == "lpush":
+        lists.setdefault(op["name"], deque()).appendleft(op["value"])
+    elif kind == "lpop":
+        lst = lists.get(op["name"])
+        if lst:
+            lst.popleft()
+    elif kind == "sadd":
+        sets_.setdefault(op["name"], set()).add(op["value"])
+    elif kind == "srem":
+        sets_.get(op["name"], set()).discard(op["value"])
+
+def _writev_all(fd: int, lines: List[bytes]) -> int:
+    """Satırları en fazla OPLOG_MAX_BATCH'lik writev'lerle yazar; kısmi yazımlarda kalanından devam eder."""
+    total = 0
+    for i in range(0, len(lines), OPLOG_MAX_BATCH):
+        views = [memoryview(line) for line in lines[i:i + OPLOG_MAX_BATCH]]
+        while views:
+            n = os.writev(fd, views)
+            total += n
+            while views and n >= len(views[0]):
+                n -= len(views.pop(0))
+            if n:
+                views[0] = views[0][n:]
+    return total
+
+def _open_oplog() -> int:
+    return os.open(PERSIST_LOG_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+def _compact_oplog(fd: int, keep: List[bytes]) -> int:
+    """Snapshot'tan yeni satırları geçici dosyaya yazıp os.replace ile log'un yerine koyar; yeni fd döner.
+
+    Log yerinde truncate edilmez: yazım yarıda kalırsa eski log olduğu gibi durur.
+    """
+    tmp = PERSIST_LOG_FILE + ".tmp"
+    tfd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        _writev_all(tfd, keep)
+        os.fsync(tfd)
+    finally:
+        os.close(tfd)
+    os.replace(tmp, PERSIST_LOG_FILE)
+    new_fd = _open_oplog()
+    os.close(fd)
+    return new_fd
+
+def _oplog_writer():
+    """Tek yazıcı thread: kuyruğu batch'ler halinde boşaltır, her batch'i tek writev + fsync ile yazar."""
+    global _oplog_bytes
+    fd = _open_oplog()
+    _oplog_bytes = os.fstat(fd).st_size
+    pending: List[tuple] = []  # son compaction'dan beri yazılan (seq, satır)
+    batches = 0
+    running = True
+    while running:
+        batch = [_oplog_queue.get()]
+        deadline = time.monotonic() + PERSIST_FLUSH_INTERVAL
+        while len(batch) < OPLOG_MAX_BATCH and batch[-1] is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_oplog_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # Her adım ayrı korunur: bir I/O hatası batch'in kalanını (kapanış işareti dahil) atlatmaz
+        lines: List[bytes] = []
+        for item in batch:
+            if item is None:  # kapanış
+                running = False
+                break
+            seq, line = item
+            if line is not None:
+                lines.append(line)
+                pending.append(item)
+                continue
+            # compaction: önce eldekileri yaz, sonra sadece snapshot'tan yeni op'ları tut
+            try:
+                if lines:
+                    _append_lines(fd, lines)
+                    lines = []
+                pending = [p for p in pending if p[0] > seq]
+                fd = _compact_oplog(fd, [p[1] for p in pending])
+                _oplog_bytes = os.fstat(fd).st_size
+                batches = 0
+            except Exception as e:
+                lines = []  # pending'de kalırlar, sonraki compaction yazar
+                print(f"[ERROR] op-log compaction failed: {e}")
+        if lines:
+            try:
+                _append_lines(fd, lines)
+                if PERSIST_LOG_FSYNC:
+                    os.fsync(fd)
+                batches += 1
+                compact = batches >= PERSIST_COMPACT_BATCHES or _oplog_bytes >= PERSIST_LOG_MAX_BYTES
+            except Exception as e:
+                print(f"[ERROR] op-log write failed: {e}")
+                compact = True  # log'a giremeyen op'ları snapshot kapsasın
+            if compact:
+                batches = 0  # snapshot başarısız olsa da bir sonraki istek K batch sonra
+                _request_compaction()
+    os.close(fd)
+
+def _append_lines(fd: int, lines: List[bytes]):
+    """Batch'i log'a ekler; yazım yarıda kalırsa dosyayı batch öncesine keser (yarım satır bırakmaz)."""
+    global _oplog_bytes
+    start = _oplog_bytes
+    try:
+        _oplog_bytes += _writev_all(fd, lines)
+    except OSError:
+        os.ftruncate(fd, start)
+        _oplog_bytes = start
+        raise
+
+def _request_compaction():
+    """Writer thread'inden loop'taki persist yazıcısını uyandırır."""
+    event = _persist_event
+    if event is None:
+        return
+    try:
+        _persist_loop_ref.call_soon_threadsafe(event.set)
+    except RuntimeError:  # loop kapanmış (shutdown sırasında)
+        pass
+
+def _replay_oplog(after_seq: int) -> int:
+    """Snapshot'tan sonraki op'ları logdan uygular; görülen en büyük seq'i döndürür.
+
+    Yarım (newline'sız) ya da bozuk ilk satırda durur ve log'u son geçerli satırın
+    sonuna kadar keser: yoksa yazıcı O_APPEND ile yeni op'ları bozuk baytların
+    arkasına ekler ve sonraki replay'de onlar da kaybolur.
+    """
+    last = after_seq
+    if not os.path.exists(PERSIST_LOG_FILE):
+        return last
+    applied = 0
+    valid_end = 0  # son geçerli satırın bittiği offset
+    with open(PERSIST_LOG_FILE, "rb") as f:
+        for line in f:
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("torn line")
+                op = orjson.loads(line)
+                seq = op["seq"]
+                if seq > after_seq:
+                    _apply_op(op)
+                    applied += 1
+            except (ValueError, TypeError, KeyError) as e:  # JSONDecodeError da ValueError
+                print(f"[WARN] op-log: torn/invalid line at offset {valid_end} ({e!r}), replay stopped")
+                break
+            valid_end += len(line)
+            last = max(last, seq)
+        size = os.fstat(f.fileno()).st_size
+    if valid_end < size:
+        os.truncate(PERSIST_LOG_FILE, valid_end)
+        print(f"[WARN] op-log truncated: {size - valid_end} bytes dropped")
+    if applied:
+        print(f"[INFO] op-log replayed: {applied} ops")
+    return last
 
 def _maybe_persist(force: bool = False):
-    global _ops_since_last_persist
-    with _persist_lock:
-        if force or _ops_since_last_persist >= PERSIST_BATCH_SIZE:
-            _persist_snapshot()
-            _ops_since_last_persist = 0
+    """Op-log aktifken compaction'ı log yazıcısı tetikler; burada zorunlu/fallback yazım kalır."""
+    global _persisted_at
+    if force:
+        _persisted_at = _mutations
+        _persist_snapshot()
+    elif _persist_event is None and _mutations - _persisted_at >= PERSIST_BATCH_SIZE:
+        _persisted_at = _mutations
+        _submit_persist()
+
+async def _persist_loop():
+    """Tek yazıcı: compaction isteğini bekler, kısa debounce sonrası bir kez snapshot alır."""
+    global _persisted_at
+    while True:
+        try:
+            await asyncio.wait_for(_persist_event.wait(), timeout=PERSIST_COMPACT_INTERVAL or None)
+        except asyncio.TimeoutError:
+            if _mutations == _persisted_at:  # son snapshot'tan beri değişiklik yok
+                continue
+        await asyncio.sleep(PERSIST_DEBOUNCE_SECONDS)
+        _persist_event.clear()
+        previous, _persisted_at = _persisted_at, _mutations
+        try:
+            # serileştirme loop'ta: seq ile içerik tutarlı; dosya/GCS I/O thread'de
+            await _run_persist()
+        except Exception as e:
+            print(f"[WARN] background persist failed: {e}")
+            _persisted_at = previous
+            # hata sürerken her log batch'i tüm state'i yeniden serileştirmesin
+            await asyncio.sleep(PERSIST_RETRY_BACKOFF)
+            _persist_event.clear()
+
+def _read_snapshot_file(path: str) -> Optional[dict]:
+    """Snapshot'ın ilk satırını mmap üzerinden okur; orjson bytes'ı kopyasız ve decode'suz parse eder."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            nl = mm.find(b"\n")
+            with memoryview(mm) as view, view[:nl if nl != -1 else len(mm)] as line:
+                return orjson.loads(line)
 
-@app.on_event("startup")
 def _load_snapshot_if_exists():
+    global _mutation_counter, _mutations, _persisted_at
     try:
-        data_bytes = None
+        snap = None
 
         # 1) Önce GCS'ten dene
         if BUCKET_NAME:
@@ -389,42 +922,92 @@ def _load_snapshot_if_exists():
                 data_bytes = _gcs_download()
                 if data_bytes:
                     print(f"[INFO] Snapshot downloaded from {BUCKET_NAME}/{SNAPSHOT_BLOB}")
+                    snap = orjson.loads(data_bytes)
             except Exception as e:
                 print(f"[WARN] GCS download failed: {e}")
 
         # 2) GCS yoksa dosyadan dene (lokal fallback)
-        if data_bytes is None and os.path.exists(PERSIST_FILE):
-            with open(PERSIST_FILE, "rb") as f:
-                data_bytes = f.readline()
+        if snap is None and os.path.exists(PERSIST_FILE):
+            snap = _read_snapshot_file(PERSIST_FILE)
 
         # 3) Belleğe yükle
-        if data_bytes:
-            snap = json.loads(data_bytes.decode("utf-8"))
+        snap_seq = 0
+        if snap:
             STORES.clear(); STORES.update(snap.get("stores", {}))
-            lists.clear();  lists.update(snap.get("lists", {}))
+            _rebuild_index()
+            lists.clear();  lists.update({k: deque(v) for k, v in snap.get("lists", {}).items()})
             sets_.clear();  sets_.update({k: set(v) for k, v in snap.get("sets", {}).items()})
+            snap_seq = snap.get("seq", 0)
             print("[INFO] snapshot restored")
         else:
             print("[INFO] no snapshot found; starting fresh")
+        # replay hata verse de yeni op'lar snapshot seq'inin üstünden numaralansın
+        _mutations = _persisted_at = snap_seq
+        _mutation_counter = itertools.count(snap_seq + 1)
+
+        # 4) Snapshot'tan sonraki op'ları uygula, seq sayacını kaldığı yerden sürdür
+        last_seq = _replay_oplog(snap_seq)
+        _mutations = last_seq
+        _persisted_at = snap_seq
+        _mutation_counter = itertools.count(last_seq + 1)
     except Exception as e:
         print(f"[WARN] snapshot load failed: {e}")
 
+async def _start_persist_writer():
+    global _persist_event, _persist_writer, _persist_loop_ref, _oplog_thread
+    _persist_loop_ref = asyncio.get_running_loop()
+    _persist_event = asyncio.Event()
+    _persist_writer = asyncio.create_task(_persist_loop())
+    _oplog_thread = threading.Thread(target=_oplog_writer, name="oplog-writer", daemon=True)
+    _oplog_thread.start()
+
+
+async def _stop_persist_writer():
+    global _persist_event, _persist_writer
+    if _persist_writer is not None:
+        _persist_writer.cancel()
+        try:
+            await _persist_writer
+        except asyncio.CancelledError:
+            pass
+    _persist_event = _persist_writer = None
 
-@app.on_event("shutdown")
 def _flush_on_shutdown():
-    _maybe_persist(force=True)
+    global _oplog_thread, _persist_executor
+    if _persist_executor is not None:
+        _persist_executor.shutdown(wait=True)  # sıradaki upload'lar bitsin
+        _persist_executor = None
+    try:
+        _maybe_persist(force=True)
+    except Exception as e:  # snapshot olmasa da op-log diskte kalır, açılışta replay edilir
+        detail = e.detail if isinstance(e, HTTPException) else e
+        print(f"[ERROR] shutdown snapshot failed: {detail}")
+    finally:
+        if _oplog_thread is not None:
+            try:  # kuyruğu (compaction işareti dahil) bitirip kapansın
+                _oplog_queue.put(None, timeout=OPLOG_SHUTDOWN_TIMEOUT)
+                _oplog_thread.join(OPLOG_SHUTDOWN_TIMEOUT)
+            except queue.Full:
+                pass
+            if _oplog_thread.is_alive():
+                print("[ERROR] op-log writer did not stop; unflushed ops may be lost")
+            _oplog_thread = None
 
 @app.get("/persist/status")
-def persist_status():
+async def persist_status():
     return {
         "file": PERSIST_FILE,
+        "log_file": PERSIST_LOG_FILE,
+        "log_bytes": _oplog_bytes,
         "batch_size": PERSIST_BATCH_SIZE,
-        "ops_since_last_persist": _ops_since_last_persist,
+        "ops_since_last_persist": _mutations - _persisted_at,
     }
 
 @app.post("/persist/flush")
-def persist_flush():
-    _maybe_persist(force=True)
+async def persist_flush():
+    global _persisted_at
+    _persisted_at = _mutations
+    await _run_persist()
     return {"ok": True, "flushed": True, "file": PERSIST_FILE}
 
 # =================================================
@@ -444,16 +1027,22 @@ def _normalize_kv_input(
         data.update(payload)
     if query_json_str:
         try:
-            qd = json.loads(query_json_str)
+            qd = orjson.loads(query_json_str)
+        except orjson.JSONDecodeError:
+            qd = None
+        if isinstance(qd, dict):
             data.update(qd)
-        except Exception:
-            pass
     if store:   data["store"] = store
     if command: data["command"] = command
     if key is not None:    data["key"] = key
     if value is not None:  data["value"] = value
     if "store" not in data or "command" not in data:
         raise HTTPException(400, "Parameters required: store, command")
+    # body'den her JSON tipi gelebilir; SortedList indeksi ve snapshot key'leri str ister
+    if not isinstance(data["store"], str):
+        raise HTTPException(400, "'store' must be a string")
+    if data.get("key") is not None and not isinstance(data["key"], str):
+        raise HTTPException(400, "'key' must be a string")
     return (
         data.get("store"),
         str(data.get("command")).lower(),
@@ -462,7 +1051,7 @@ def _normalize_kv_input(
     )
 
 @app.post("/KV")
-def kv_compat(
+async def kv_compat(
     store: Optional[str] = Query(None),
     command: Optional[str] = Query(None),
     key: Optional[str] = Query(None),
@@ -471,40 +1060,56 @@ def kv_compat(
     payload: Optional[dict] = Body(None)
 ):
     store, cmd, key, val = _normalize_kv_input(store, command, key, value, query, payload)
-    s = ensure_store(store)
-
-    if cmd in ("read", "get"):
-        if not key:
-            raise HTTPException(400, "read requires 'key'")
-        if key not in s:
-            return {"ok": False, "store": store, "key": key, "found": False, "value": None}
-        return {"ok": True, "store": store, "key": key, "found": True, "value": s[key]}
-
-    elif cmd in ("push", "set", "write"):
-        if not key:
-            raise HTTPException(400, "push requires 'key'")
-        s[key] = val
-        _bump_mutation(); _maybe_persist()
-        return {"ok": True, "store": store, "key": key, "value": s[key]}
+    handler = _KV_HANDLERS.get(cmd)
+    if handler is None:
+        raise HTTPException(400, f"Unknown command: {cmd}")
+    return _json_response(handler(store, key, val))
 
-    elif cmd in ("del", "delete", "remove"):
-        if not key:
-            raise HTTPException(400, "del requires 'key'")
-        existed = key in s
-        if existed:
-            del s[key]
-            _bump_mutation(); _maybe_persist()
-        return {"ok": True, "store": store, "key": key, "deleted": existed}
+# Sadece yazma store oluşturur (replay'de "set" op'u store'u da kurar);
+# okuma/silme/listeleme olmayan store'u boş kabul eder, MAX_STORES'a takılmaz.
+def _kv_read(store: str, key: Optional[str], val: Any):
+    if not key:
+        raise HTTPException(400, "read requires 'key'")
+    s = STORES.get(store)
+    if s is None or key not in s:
+        return {"ok": False, "store": store, "key": key, "found": False, "value": None}
+    return {"ok": True, "store": store, "key": key, "found": True, "value": s[key]}
 
-    elif cmd == "keys":
-        keys = sorted(list(s.keys()))
-        return {"ok": True, "store": store, "count": len(keys), "keys": keys}
+def _kv_write(store: str, key: Optional[str], val: Any):
+    if not key:
+        raise HTTPException(400, "push requires 'key'")
+    s = ensure_store(store)
+    if key not in s:
+        _check_capacity(len(s), MAX_KEYS_PER_STORE, f"Store '{store}' key")
+        STORE_INDEX[store].add(key)
+    s[key] = val
+    _bump_mutation(); _append_op({"op": "set", "store": store, "key": key, "value": val}); _maybe_persist()
+    return {"ok": True, "store": store, "key": key, "value": s[key]}
 
-    else:
-        raise HTTPException(400, f"Unknown command: {cmd}")
+def _kv_delete(store: str, key: Optional[str], val: Any):
+    if not key:
+        raise HTTPException(400, "del requires 'key'")
+    s = STORES.get(store)
+    existed = s is not None and key in s
+    if existed:
+        del s[key]
+        STORE_INDEX[store].remove(key)
+        _bump_mutation(); _append_op({"op": "del", "store": store, "key": key}); _maybe_persist()
+    return {"ok": True, "store": store, "key": key, "deleted": existed}
+
+def _kv_keys(store: str, key: Optional[str], val: Any):
+    keys = list(STORE_INDEX.get(store, ()))  # indeks zaten sıralı; sort gerekmez
+    return {"ok": True, "store": store, "count": len(keys), "keys": keys}
+
+# /KV komut takma adları -> handler (tek hash lookup ile dispatch)
+_KV_HANDLERS = {
+    "read": _kv_read, "get": _kv_read,
+    "push": _kv_write, "set": _kv_write, "write": _kv_write,
+    "del": _kv_delete, "delete": _kv_delete, "remove": _kv_delete,
+    "keys": _kv_keys,
+}
 
 if __name__ == "__main__":
-    import os
     import uvicorn
     port = int(os.environ.get("PORT", 8080))
     uvicorn.run("main:app", host="0.0.0.0", port=port)
@@ -0,0 +1,19 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """Boş bellek ve geçici snapshot/op-log dosyalarıyla çalışan uygulama (GCS kapalı)."""
+    monkeypatch.setattr(main, "BUCKET_NAME", "")
+    monkeypatch.setattr(main, "PERSIST_FILE", str(tmp_path / "snap.json"))
+    monkeypatch.setattr(main, "PERSIST_LOG_FILE", str(tmp_path / "snap.json.log"))
+    state = (main.STORES, main.STORE_INDEX, main.lists, main.sets_)
+    for d in state:
+        d.clear()
+    with TestClient(main.app) as c:
+        yield c
+    for d in state:
+        d.clear()
@@ -0,0 +1,61 @@
+import gzip
+
+import main
+
+
+class _FakeBlob:
+    def __init__(self, data: bytes, content_encoding=None):
+        self.data = data
+        self.content_encoding = content_encoding
+        self.raw_download = None
+
+    def download_as_bytes(self, raw_download=False):
+        self.raw_download = raw_download
+        return self.data
+
+
+class _FakeClient:
+    def __init__(self, blobs):
+        self.blobs = blobs
+
+    def bucket(self, name):
+        return self
+
+    def get_blob(self, name):
+        return self.blobs.get(name)
+
+
+def _use_bucket(monkeypatch, blobs):
+    monkeypatch.setattr(main, "BUCKET_NAME", "bucket")
+    monkeypatch.setattr(main, "SNAPSHOT_BLOB", "snap.json")
+    monkeypatch.setattr(main, "_get_gcs_client", lambda: _FakeClient(blobs))
+
+
+def test_download_gunzips_gzip_encoded_blob(monkeypatch):
+    body = b'{"stores":{"a":{"k":1}},"seq":3}\n'
+    blob = _FakeBlob(gzip.compress(body), content_encoding="gzip")
+    _use_bucket(monkeypatch, {"snap.json": blob})
+
+    assert main._gcs_download() == body
+    assert blob.raw_download is True  # kütüphanenin otomatik decode'u atlanır
+
+
+def test_download_plain_blob_as_is(monkeypatch):
+    body = b'{"stores":{},"seq":0}\n'
+    _use_bucket(monkeypatch, {"snap.json": _FakeBlob(body)})
+
+    assert main._gcs_download() == body
+
+
+def test_download_missing_blob_returns_none(monkeypatch):
+    _use_bucket(monkeypatch, {})
+
+    assert main._gcs_download() is None
+
+
+def test_gzip_tee_matches_written_snapshot():
+    snap = {"stores": {"a": {"k": 1}, "b": {}}, "lists": {"l": ["x"]}, "sets": {}, "seq": 7, "timestamp": "t"}
+    gz = []
+    written = b"".join(main._gzip_tee(main._dump_snapshot(snap), gz))
+
+    assert gzip.decompress(b"".join(gz)) == written
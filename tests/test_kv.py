@@ -0,0 +1,29 @@
+import main
+
+
+def test_kv_rejects_non_str_key(client):
+    r = client.post("/KV", json={"store": "b", "command": "set", "key": 5, "value": 1})
+    assert r.status_code == 400
+    assert r.json()["detail"] == "'key' must be a string"
+    assert client.post("/KV", json={"store": "b", "command": "set", "key": "x", "value": 1}).status_code == 200
+    assert client.post("/snapshot").status_code == 200
+
+
+def test_kv_rejects_non_str_store(client):
+    r = client.post("/KV", json={"store": 1, "command": "set", "key": "k", "value": 1})
+    assert r.status_code == 400
+    assert main.STORES == {}
+
+
+def test_kv_reads_do_not_create_stores(client, monkeypatch):
+    monkeypatch.setattr(main, "MAX_STORES", 1)
+    client.put("/stores/a")
+
+    read = client.post("/KV", json={"store": "zz", "command": "get", "key": "k"})
+    assert read.status_code == 200
+    assert read.json()["found"] is False
+    assert client.post("/KV", json={"store": "zz", "command": "keys"}).json()["keys"] == []
+    assert client.post("/KV", json={"store": "zz", "command": "del", "key": "k"}).json()["deleted"] is False
+    assert list(main.STORES) == ["a"]
+    # yazma store oluşturur ve limite takılır
+    assert client.post("/KV", json={"store": "zz", "command": "set", "key": "k", "value": 1}).status_code == 507
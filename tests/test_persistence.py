@@ -0,0 +1,192 @@
+# Op-log + snapshot kalıcılığı: crash sonrası replay ve compaction testleri.
+# Uygulama durumu modül seviyesinde tutulduğu için her "süreç ömrü" ayrı bir
+# python alt sürecinde çalıştırılır; crash os._exit ile (shutdown snapshot'ı olmadan) yapılır.
+
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+
+import orjson
+
+import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(tmp_path, body: str, **env) -> str:
+    script = textwrap.dedent("""
+        import os, time, warnings
+        warnings.simplefilter("ignore")
+        from fastapi.testclient import TestClient
+        import main
+        c = TestClient(main.app)
+        c.__enter__()
+    """) + textwrap.dedent(body)
+    proc_env = {
+        **os.environ,
+        "BUCKET_NAME": "",
+        "PERSIST_FILE": str(tmp_path / "snap.json"),
+        **env,
+    }
+    out = subprocess.run(
+        [sys.executable, "-c", script], cwd=ROOT, env=proc_env,
+        capture_output=True, text=True, timeout=60,
+    )
+    assert out.returncode == 0, out.stderr
+    return out.stdout
+
+
+def _log_seqs(tmp_path):
+    with open(tmp_path / "snap.json.log", "rb") as f:
+        return [orjson.loads(line)["seq"] for line in f]
+
+
+def test_replay_after_crash(tmp_path):
+    _run(tmp_path, """
+        for i in range(5):
+            c.post("/stores/a/set", json={"key": f"k{i}", "value": i})
+        c.delete("/stores/a/del/k0")
+        c.post("/command", json={"command": "LPUSH", "stack_name": "l", "value": "x"})
+        c.post("/command", json={"command": "SADD", "stack_name": "s", "value": "y"})
+        time.sleep(0.5)  # grup commit penceresi geçsin
+        os._exit(0)
+    """)
+    assert not os.path.exists(tmp_path / "snap.json")  # sadece op-log ile geri dönülecek
+
+    out = _run(tmp_path, """
+        print(main.STORES, list(main.STORE_INDEX["a"]), dict(main.lists), main.sets_, main._mutations)
+        os._exit(0)
+    """)
+    assert out.strip().splitlines()[-1] == (
+        "{'a': {'k1': 1, 'k2': 2, 'k3': 3, 'k4': 4}} ['k1', 'k2', 'k3', 'k4'] "
+        "{'l': deque(['x'])} {'s': {'y'}} 8"
+    )
+
+
+def test_compaction_then_replay(tmp_path):
+    # her log batch'inde compaction iste: snapshot + log budama + yeni op'lar
+    _run(tmp_path, """
+        for i in range(20):
+            c.post("/stores/a/set", json={"key": f"k{i:02d}", "value": i})
+            time.sleep(0.03)
+        time.sleep(1)
+        os._exit(0)
+    """, PERSIST_COMPACT_BATCHES="1", PERSIST_DEBOUNCE_SECONDS="0")
+
+    with open(tmp_path / "snap.json", "rb") as f:
+        snap_seq = orjson.loads(f.read())["seq"]
+    assert snap_seq > 0
+    assert all(seq > snap_seq for seq in _log_seqs(tmp_path))
+
+    out = _run(tmp_path, """
+        print(sorted(main.STORES["a"].items()) == [(f"k{i:02d}", i) for i in range(20)], main._mutations)
+        os._exit(0)
+    """)
+    assert out.strip().splitlines()[-1] == "True 20"
+
+
+def test_compaction_keeps_tail_longer_than_iov_max(tmp_path, monkeypatch):
+    # snapshot yazılırken 1024'ten (IOV_MAX) fazla op birikirse log kaybolmamalı
+    monkeypatch.setattr(main, "PERSIST_LOG_FILE", str(tmp_path / "snap.json.log"))
+    monkeypatch.setattr(main, "_persist_event", None)
+    for seq in range(1, 2001):
+        main._oplog_queue.put((seq, orjson.dumps({"op": "create_store", "store": f"s{seq}", "seq": seq}) + b"\n"))
+    main._oplog_queue.put((10, None))
+    main._oplog_queue.put(None)
+
+    main._oplog_writer()
+
+    assert _log_seqs(tmp_path) == list(range(11, 2001))
+    assert main._oplog_bytes == os.path.getsize(tmp_path / "snap.json.log")
+
+
+def test_oplog_drained_when_shutdown_snapshot_fails(tmp_path):
+    # snapshot yolu bir dizin: shutdown snapshot'ı hata verir ama op-log yine de yazılmalı
+    os.mkdir(tmp_path / "snap.json")
+    _run(tmp_path, """
+        c.post("/stores/a/set", json={"key": "k", "value": 1})
+        c.__exit__(None, None, None)
+    """, PERSIST_LOG_FILE=str(tmp_path / "snap.json.log"))
+    assert _log_seqs(tmp_path) == [1]
+
+
+def test_torn_tail_is_truncated_before_new_ops(tmp_path):
+    _run(tmp_path, """
+        c.post("/stores/a/set", json={"key": "k1", "value": 1})
+        time.sleep(0.5)
+        os._exit(0)
+    """)
+    with open(tmp_path / "snap.json.log", "ab") as f:
+        f.write(b'{"op":"set","store":"a","ke')  # yazım sırasında crash
+    for i in (2, 3):
+        _run(tmp_path, f"""
+            c.post("/stores/a/set", json={{"key": "k{i}", "value": {i}}})
+            time.sleep(0.5)
+            os._exit(0)
+        """)
+
+    out = _run(tmp_path, """
+        print(main.STORES["a"], main._mutations)
+        os._exit(0)
+    """)
+    assert out.strip().splitlines()[-1] == "{'k1': 1, 'k2': 2, 'k3': 3} 3"
+    assert _log_seqs(tmp_path) == [1, 2, 3]
+
+
+def test_bad_log_line_keeps_seq_above_snapshot(tmp_path):
+    with open(tmp_path / "snap.json", "wb") as f:
+        f.write(orjson.dumps({"stores": {"a": {"k": 1}}, "lists": {}, "sets": {}, "seq": 100}) + b"\n")
+    with open(tmp_path / "snap.json.log", "wb") as f:
+        f.write(b'{"op":"set","store":"a","seq":101}\n[1,2]\n')  # "key" eksik, dict olmayan satır
+
+    out = _run(tmp_path, """
+        c.post("/stores/a/set", json={"key": "k2", "value": 2})
+        time.sleep(0.5)
+        print(main.STORES["a"], main._mutations)
+        os._exit(0)
+    """)
+    assert out.strip().splitlines()[-1] == "{'k': 1, 'k2': 2} 101"
+    assert _log_seqs(tmp_path) == [101]
+
+
+def _line(seq: int) -> tuple:
+    return seq, orjson.dumps({"op": "create_store", "store": f"s{seq}", "seq": seq}) + b"\n"
+
+
+def test_writer_stops_even_if_compaction_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "PERSIST_LOG_FILE", str(tmp_path / "snap.json.log"))
+    monkeypatch.setattr(main, "_persist_event", None)
+
+    def failing_compact(fd, keep):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(main, "_compact_oplog", failing_compact)
+    for item in (_line(1), (1, None), None):  # kapanıştaki sıra: op, compaction işareti, kapanış
+        main._oplog_queue.put(item)
+
+    writer = threading.Thread(target=main._oplog_writer, daemon=True)
+    writer.start()
+    writer.join(5)
+
+    assert not writer.is_alive()
+    assert _log_seqs(tmp_path) == [1]
+
+
+def test_failed_batch_write_leaves_no_partial_line(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "PERSIST_LOG_FILE", str(tmp_path / "snap.json.log"))
+    monkeypatch.setattr(main, "_persist_event", None)
+
+    def short_then_fail(fd, lines):
+        os.write(fd, lines[0][:5])
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(main, "_writev_all", short_then_fail)
+    main._oplog_queue.put(_line(1))
+    main._oplog_queue.put(None)
+
+    main._oplog_writer()
+
+    assert os.path.getsize(tmp_path / "snap.json.log") == 0
+    assert main._oplog_bytes == 0
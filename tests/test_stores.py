@@ -0,0 +1,71 @@
+import orjson
+
+import main
+
+
+def test_store_and_key_limits_return_507(client, monkeypatch):
+    monkeypatch.setattr(main, "MAX_STORES", 1)
+    monkeypatch.setattr(main, "MAX_KEYS_PER_STORE", 2)
+
+    assert client.put("/stores/a").status_code == 200
+    r = client.put("/stores/b")
+    assert r.status_code == 507
+    assert r.json()["detail"] == "Store limit reached (1)"
+    assert "b" not in main.STORES
+
+    for key in ("k1", "k2"):
+        assert client.post("/stores/a/set", json={"key": key, "value": 1}).status_code == 200
+    r = client.post("/stores/a/set", json={"key": "k3", "value": 1})
+    assert r.status_code == 507
+    assert r.json()["detail"] == "Store 'a' key limit reached (2)"
+    # var olan key'in üzerine yazmak limite takılmaz
+    assert client.post("/stores/a/set", json={"key": "k1", "value": 2}).status_code == 200
+    assert list(main.STORE_INDEX["a"]) == ["k1", "k2"]
+
+
+def test_list_and_set_limits_return_507(client, monkeypatch):
+    monkeypatch.setattr(main, "MAX_STORES", 1)
+    monkeypatch.setattr(main, "MAX_KEYS_PER_STORE", 1)
+
+    def cmd(command, name, value=None):
+        return client.post("/command", json={"command": command, "stack_name": name, "value": value})
+
+    assert cmd("LPUSH", "l", "x").status_code == 200
+    assert cmd("LPUSH", "l", "y").status_code == 507
+    assert cmd("LPUSH", "other", "x").status_code == 507
+    assert cmd("SADD", "s", "x").status_code == 200
+    assert cmd("SADD", "s", "x").status_code == 200  # zaten üye: yeni eleman değil
+    assert cmd("SADD", "s", "y").status_code == 507
+
+
+def test_keys_prefix_scan(client):
+    for key in ("l", "ka", "k10", "b2", "k1", "j"):
+        client.post("/stores/a/set", json={"key": key, "value": 0})
+
+    def keys(prefix=None):
+        params = {"prefix": prefix} if prefix is not None else {}
+        return client.get("/stores/a/keys", params=params).json()
+
+    assert keys() == {"store": "a", "count": 6, "keys": ["b2", "j", "k1", "k10", "ka", "l"]}
+    assert keys("k")["keys"] == ["k1", "k10", "ka"]
+    assert keys("k1")["keys"] == ["k1", "k10"]
+    assert keys("k10")["keys"] == ["k10"]
+    assert keys("kz") == {"store": "a", "count": 0, "keys": []}
+    assert keys("m")["keys"] == []
+
+
+def test_items_stream_joins_batches(client, monkeypatch):
+    monkeypatch.setattr(main, "ITEMS_STREAM_BATCH", 2)
+    for n in (1, 2, 5):  # tek batch, tam katı, yarım son batch
+        store = f"s{n}"
+        items = [{"key": f"k{i}", "value": {"i": i, "tags": ["a", "b"]}} for i in range(n)]
+        for item in items:
+            client.post(f"/stores/{store}/set", json=item)
+        r = client.get(f"/stores/{store}/items")
+        assert r.status_code == 200
+        assert r.headers["content-type"] == "application/json"
+        assert orjson.loads(r.content) == {"store": store, "size": n, "items": items}
+
+
+def test_items_missing_store_is_404(client):
+    assert client.get("/stores/nope/items").status_code == 404